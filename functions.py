@@ -1,13 +1,46 @@
 import pandas as pd
 import numpy as np
 import inspect
+import re
+import functools
+import collections
 import sys
 import geopandas as gpd
 import matplotlib.pyplot as plt
-from shapely.geometry import Point
 import datetime
 
 
+@functools.lru_cache(maxsize=1)
+def _load_kr_basemap() -> tuple:
+    """
+       Load the South Korea map layers used by plot_data.
+
+       The shapefiles are read and filtered only once, later calls
+       return the cached GeoDataFrames.
+
+       Returns:
+           tuple: A tuple containing the country, district and city name
+           GeoDataFrames.
+    """
+    # Load a shapefile of the map or any other geospatial data
+    # (filtering is pushed down to GDAL through the where clause)
+    map_data = gpd.read_file(r'maps\ne_10m_admin_0_countries.shp',
+                             engine='pyogrio',
+                             use_arrow=True,
+                             where="SOVEREIGNT = 'South Korea'")
+    # Load a shapefile of the district boundaries
+    district_data = gpd.read_file(r'maps\ne_10m_admin_1_states_provinces.shp',
+                                  engine='pyogrio',
+                                  use_arrow=True,
+                                  where="iso_a2 = 'KR'")
+    # Load a shapefile of the city names
+    name_data = gpd.read_file(r'maps\ne_10m_populated_places.shp',
+                              engine='pyogrio',
+                              use_arrow=True,
+                              where='SCALERANK <= 6')
+    return map_data, district_data, name_data
+
+
 def plot_data(mapping_data: pd.DataFrame, zoom_level: int = 0.5) -> None:
     """
        Plot some data on a map of South Korea.
@@ -21,46 +54,48 @@ def plot_data(mapping_data: pd.DataFrame, zoom_level: int = 0.5) -> None:
        Returns:
            None
     """
-    # Load a shapefile of the map or any other geospatial data
-    map_data = gpd.read_file(r'maps\ne_10m_admin_0_countries.shp')
-    map_data = map_data[map_data['SOVEREIGNT'] == 'South Korea']
-    # Load a shapefile of the district boundaries
-    district_data = gpd.read_file(r'maps\ne_10m_admin_1_states_provinces.shp')
-    district_data = district_data[district_data['iso_a2'] == 'KR']
-    # Load a shapefile of the city names
-    name_data = gpd.read_file(r'maps\ne_10m_populated_places.shp')
-    name_data = name_data[name_data['SCALERANK'] <= 6]
+    # Extract the plotted columns once as contiguous arrays
+    longitudes = mapping_data['longitude'].to_numpy(dtype=np.float64,
+                                                    copy=False)
+    latitudes = mapping_data['latitude'].to_numpy(dtype=np.float64,
+                                                  copy=False)
+    sizes = mapping_data['confirmed'].to_numpy()
+    # Load the cached map layers
+    map_data, district_data, name_data = _load_kr_basemap()
     # Create a figure and axis
     fig, ax = plt.subplots(figsize=(8, 8))
-    # Plot the map data
-    map_data.plot(ax=ax)
-    # Plot the district boundaries
-    district_data.plot(ax=ax, edgecolor='black', facecolor='none')
-    # Plot the city names
-    name_data.plot(ax=ax, color='black', markersize=3)
-    # Set the extent and aspect ratio of the plot
-    extent = [mapping_data['longitude'].min() - zoom_level,
-              mapping_data['longitude'].max() + zoom_level,
-              mapping_data['latitude'].min() - zoom_level,
-              mapping_data['latitude'].max() + zoom_level]
+    # Set the extent and aspect ratio of the plot before drawing the layers,
+    # so they are clipped to it and autoscaling is skipped
+    extent = [np.nanmin(longitudes) - zoom_level,
+              np.nanmax(longitudes) + zoom_level,
+              np.nanmin(latitudes) - zoom_level,
+              np.nanmax(latitudes) + zoom_level]
     ax.set_xlim(extent[0], extent[1])
     ax.set_ylim(extent[2], extent[3])
     ax.set_aspect('equal')
-    # Create the geometry column using the latitude
-    # and longitude columns from the DataFrame
-    point_geometry = [Point(xy) for xy in zip(mapping_data['longitude'],
-                                              mapping_data['latitude'])]
-    # Create a GeoDataFrame from the DataFrame with the geometry column
-    points = gpd.GeoDataFrame(mapping_data, geometry=point_geometry)
-    # Plot the data
-    points.plot(ax=ax,
-                color='red',
-                markersize=mapping_data.confirmed,
-                alpha=0.5)
-    # Add city names as text annotations
-    for x, y, name in zip(name_data.geometry.x,
-                          name_data.geometry.y,
-                          name_data['NAME']):
+    ax.set_autoscale_on(False)
+    # Plot the map data
+    map_data.plot(ax=ax, aspect=None)
+    # Plot the district boundaries
+    district_data.plot(ax=ax, edgecolor='black', facecolor='none',
+                       aspect=None)
+    # Plot the city names
+    name_data.plot(ax=ax, color='black', markersize=3, aspect=None)
+    # Plot the data as a single rasterized scatter collection
+    ax.scatter(longitudes,
+               latitudes,
+               s=sizes,
+               c='red',
+               alpha=0.5,
+               edgecolors='none',
+               rasterized=True,
+               zorder=2)
+    # Add city names as text annotations, skipping the cities
+    # outside of the plotted extent
+    visible_names = name_data.cx[extent[0]:extent[1], extent[2]:extent[3]]
+    for x, y, name in zip(visible_names.geometry.x,
+                          visible_names.geometry.y,
+                          visible_names['NAME']):
         ax.annotate(text=name,
                     xy=(x, y),
                     xytext=(3, 3),
@@ -83,8 +118,8 @@ def find_word(dataframe: pd.DataFrame, column: str, word: str) -> pd.DataFrame:
         filtered_df (pd.DataFrame): A new pandas DataFrame containing rows
         where the specified word is found in the specified column.
     """
-    pattern = fr'\b{word}s?\b'
-    mask = dataframe[column].str.contains(pattern, regex=True)
+    pattern = fr'\b{re.escape(word)}s?\b'
+    mask = dataframe[column].str.contains(pattern, regex=True, na=False)
     filtered_df = dataframe[mask]
     return filtered_df
 
@@ -104,9 +139,9 @@ def count_words(dataframe: pd.DataFrame, column: str, n: int = 3) -> list:
         words (list): A list of the n most frequent last words
         in the specified column.
     """
-    last_words = dataframe[column].str.split().str[-1]
-    word_counts = last_words.value_counts()
-    words = word_counts.head(n).index.tolist()
+    last_words = dataframe[column].str.rsplit(n=1).str[-1].dropna()
+    word_counts = collections.Counter(last_words.to_numpy())
+    words = [word for word, _ in word_counts.most_common(n)]
     return words
 
 
@@ -135,11 +170,9 @@ def get_date_range(chosen_date: datetime.datetime, days: int) -> list:
         #          datetime.datetime(2023, 4, 30)]
     """
     start_date = chosen_date - datetime.timedelta(days=days)
-    date_range = []
-
-    for i in range(7):
-        date = start_date + datetime.timedelta(days=i)
-        date_range.append(date)
+    date_range = pd.date_range(start=start_date,
+                               periods=days,
+                               freq='D').to_pydatetime().tolist()
 
     return date_range
 
@@ -180,17 +213,42 @@ def get_matching_entries(dates_of_interest: list,
         - The 'data' DataFrame should contain a column specified by
         'date_column' that contains the dates to be compared.
         - The 'days' parameter specifies the number of days in the date range.
+        - Dates with a time of day match if they fall on a day of the range.
+        - Entries matching several overlapping date ranges are returned once,
+        sorted by 'date_column'.
     """
-    matching_entries = pd.DataFrame()
-
+    # Each date range covers whole days from its first to its last date
+    window_starts = []
+    window_ends = []
     for date_str in dates_of_interest:
         date_obj = datetime.datetime.strptime(date_str, '%Y-%m-%d')
         date_range = get_date_range(date_obj, days)
-        matching_df = data[data[date_column].isin(date_range)]
-        matching_entries = pd.concat([matching_entries, matching_df],
-                                     ignore_index=True)
-
-    return matching_entries
+        if date_range:
+            window_starts.append(date_range[0])
+            window_ends.append(date_range[-1] + datetime.timedelta(days=1))
+
+    column_dates = data[date_column]
+    if not pd.api.types.is_datetime64_any_dtype(column_dates):
+        column_dates = pd.to_datetime(column_dates, errors='coerce')
+    if column_dates.dt.tz is not None:
+        # Compare timezone-aware dates by their local calendar dates
+        column_dates = column_dates.dt.tz_localize(None)
+    # Sort the dates once and find each date range with a binary search
+    order = np.argsort(column_dates.to_numpy(), kind='stable')
+    sorted_dates = column_dates.to_numpy()[order]
+    starts = np.searchsorted(sorted_dates,
+                             np.array(window_starts, dtype='datetime64[ns]'),
+                             side='left')
+    ends = np.searchsorted(sorted_dates,
+                           np.array(window_ends, dtype='datetime64[ns]'),
+                           side='left')
+
+    matched = np.zeros(len(sorted_dates), dtype=bool)
+    for start, end in zip(starts, ends):
+        matched[start:end] = True
+    matching_entries = data.iloc[order[matched]]
+
+    return matching_entries.reset_index(drop=True)
 
 
 def set_parameters(title: str, xlabel: str,
@@ -229,20 +287,59 @@ def calculate_differences(data: pd.DataFrame, index_column: str,
 
         Returns:
             tuple: A tuple containing the dictionaries of differences and
-            fatalities, the dates for the last subset, and the unique values.
+            fatalities, the dates of the differences, and the unique values.
+
+        Note:
+            - The 'data' DataFrame should have a 'date' index level.
+            - The differences are taken in the row order of 'data'.
+            - The dates are those of the last subset, without its first date.
 
     """
     unique_values = data.index.get_level_values(index_column).unique()
+    other_levels = data.index.droplevel(index_column)
+    values = data[[value_column, 'fatalities, %']]
 
     differences = {}
     differences_fatalities = {}
 
-    for value in unique_values:
-        subset = data[data.index.get_level_values(index_column) == value]
-        differences[value] = np.diff(subset[value_column])
-        differences_fatalities[value] = np.diff(subset['fatalities, %'])
-
-    dates = subset.index.get_level_values('date')[1:]
+    if (other_levels.is_monotonic_increasing
+            and not data.index.has_duplicates
+            and len(data) == len(unique_values) * other_levels.nunique()):
+        # Every value has one entry per date in date order, so lay every
+        # group out as its own column, indexed by date, without any padding
+        pivot = values.unstack(level=index_column)
+        value_diffs = np.diff(pivot[value_column].to_numpy(), axis=0)
+        fatality_diffs = np.diff(pivot['fatalities, %'].to_numpy(), axis=0)
+
+        for i, value in enumerate(pivot[value_column].columns):
+            differences[value] = value_diffs[:, i]
+            differences_fatalities[value] = fatality_diffs[:, i]
+
+        dates = pivot.index.get_level_values('date')[1:]
+    else:
+        grouped = values.groupby(level=index_column, sort=False)
+        # Drop the first row of every group, which has nothing to diff
+        # against, and keep the integer columns as integers
+        diffs = grouped.diff()[grouped.cumcount().to_numpy() > 0]
+        diffs = diffs.astype(values.dtypes.to_dict())
+
+        # Sort once so every group is a contiguous block found by
+        # binary search
+        keys = diffs.index.get_level_values(index_column)
+        if not keys.is_monotonic_increasing:
+            diffs = diffs.sort_index(level=index_column,
+                                     sort_remaining=False,
+                                     kind='mergesort')
+            keys = diffs.index.get_level_values(index_column)
+
+        for value in unique_values:
+            start = keys.searchsorted(value, side='left')
+            end = keys.searchsorted(value, side='right')
+            subset = diffs.iloc[start:end]
+            differences[value] = subset[value_column].to_numpy()
+            differences_fatalities[value] = subset['fatalities, %'].to_numpy()
+
+        dates = subset.index.get_level_values('date')
 
     return differences, differences_fatalities, dates, unique_values
 
@@ -262,11 +359,26 @@ def plot_differences(unique_values: pd.Index,
         None
 
     """
-    for value in unique_values:
-        plt.plot(xaxis, yaxis[value], label=value)
+    if len(unique_values) == 0:
+        return
+
+    yvalues = np.column_stack([yaxis[value] for value in unique_values])
+    lines = plt.plot(xaxis, yvalues)
+    for line, value in zip(lines, unique_values):
+        line.set_label(value)
 
 
-imported_functions = [name for name, _ in inspect.getmembers(
-    sys.modules[__name__], inspect.isfunction)]
+def list_functions() -> list:
+    """
+    List the functions defined in this module.
+
+    Returns:
+        functions (list): A list of the function names.
+    """
+    functions = [name for name, _ in inspect.getmembers(
+        sys.modules[__name__], inspect.isfunction)]
+    return functions
+
 
-print(f'Imported functions: {imported_functions}')
+if __name__ == '__main__':
+    print(f'Imported functions: {list_functions()}')